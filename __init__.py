@@ -5,15 +5,17 @@ from .backends import EfficientBackend, LegacyBackend
 from .circuits import EfficientCircuit
 from .quantum_algorithms import hadamard_reverse_qft_circ, ghz_circ, qft_circ, qaoa_circ
 from .integrators import Integrator
-from .metrics import hellinger_distance
+from .metrics import hellinger_distance, hellinger_distance_batch
 from .utilities import (
     DeviceParameters,
     multiprocessing_parallel_simulation,
     mock_parallel_simulation,
     concurrent_parallel_simulation,
     fix_counts,
+    fix_counts_array,
     load_config,
     create_qc_list,
+    create_qc_list_parameterized,
     setup_backend,
     post_process_split,
     hellinger_distance,
@@ -29,15 +31,17 @@ __all__ += ["EfficientBackend", "LegacyBackend"]
 __all__ += ["EfficientCircuit"]
 __all__ += ["hadamard_reverse_qft_circ", "ghz_circ", "qft_circ", "qaoa_circ"]
 __all__ += ["Integrator"]
-__all__ += ["hellinger_distance"]
+__all__ += ["hellinger_distance", "hellinger_distance_batch"]
 __all__ += [
     "DeviceParameters",
     "multiprocessing_parallel_simulation",
     "mock_parallel_simulation",
     "concurrent_parallel_simulation",
     "fix_counts",
+    "fix_counts_array",
     "load_config",
     "create_qc_list",
+    "create_qc_list_parameterized",
     "setup_backend",
     "post_process_split",
 ]
@@ -1,46 +1,117 @@
 import numpy as np
+import functools as ft
+import itertools
 import multiprocessing
 import json
 import os
+import hashlib
+import importlib.util
 import concurrent.futures
-
-from qiskit import transpile
-from qiskit.transpiler import CouplingMap
-from qiskit_aer import AerSimulator
+import dill
+
+import qiskit
+from qiskit import qpy
+from qiskit.exceptions import QiskitError
+from qiskit.transpiler import CouplingMap, Layout, PassManager, StagedPassManager
+from qiskit.transpiler.passes import SetLayout, FullAncillaAllocation, EnlargeWithAncilla, ApplyLayout
+from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+try:
+    from qiskit.utils.parallel import parallel_map
+except ImportError:  # Qiskit < 0.46
+    from qiskit.tools.parallel import parallel_map
 from qiskit_ibm_provider import IBMProvider
 
 
+@ft.lru_cache(maxsize=32)
+def _bit_reversal_table(n_qubits: int) -> np.ndarray:
+    """ Returns the lookup table mapping each integer of n_qubits bits to the integer with the bits in reverse order.
+    """
+    states = np.arange(1 << n_qubits, dtype=np.int64)
+    table = np.zeros_like(states)
+    for b in range(n_qubits):
+        table |= ((states >> b) & 1) << (n_qubits - 1 - b)
+    table.flags.writeable = False
+    return table
+
+
+@ft.lru_cache(maxsize=32)
+def _bit_string_labels(n_qubits: int) -> tuple:
+    """ Returns the zero padded bit strings of all states of n_qubits qubits in increasing order.
+    """
+    fmt = f"{{:0{n_qubits}b}}"
+    return tuple(fmt.format(i) for i in range(1 << n_qubits))
+
+
 def fix_counts(counts_0: dict, n_qubits: int):
     """ Fixes the qiskit counts in the standard convention, orders the list and adds strings with zero counts.
     """
+    dense_counts = fix_counts_array(counts_0, n_qubits)
 
-    # Mirror the bit strings to pass in standard convention
-    mirrored_counts = {j[::-1]: counts_0[j] for j in counts_0}
+    # Label each state with its bit string, states without counts are kept with zero
+    return list(zip(_bit_string_labels(n_qubits), dense_counts.tolist()))
 
-    # Sort the results and return a list
-    dict_items = mirrored_counts.items()
-    counts = sorted(dict_items)
 
-    # Add element 00 if it is missing
-    if int(counts[0][0], 2) != 0:
-        zero = format(0, 'b').zfill(n_qubits)
-        counts.insert(0, (zero, 0))
+def fix_counts_array(counts_0: dict, n_qubits: int) -> np.array:
+    """ Fixes the qiskit counts in the standard convention and returns them as dense array.
 
-    # Add element 11 if it is missing
-    if int(counts[len(counts)-1][0], 2) != 2**n_qubits - 1:
-        uno = format(2**n_qubits -1, 'b').zfill(n_qubits)
-        counts.insert(len(counts), (uno, 0))
-        
-    for j in range(2**n_qubits-1):
-        # Add missing elements
-        if int(counts[j+1][0], 2) != int(counts[j][0],2) + 1:
-            new = int(counts[j][0], 2) + 1
-            new_bin = format(new, 'b').zfill(n_qubits)
-            counts.insert(j+1, (new_bin, 0))
-        else:
-            pass
-        
-    return counts
+    The entry i of the array holds the counts of the state whose bit string is the binary representation of i, states
+    without counts are kept with zero. Divided by the number of shots, it can be passed to compute_Hellinger_distance.
+    The array has the dtype of the given values, so integer counts and float probabilities are both kept.
+    """
+
+    # Mirror the bit strings to pass in standard convention and scatter the counts into a dense histogram
+    keys = np.fromiter((int(j, 2) for j in counts_0), dtype=np.int64, count=len(counts_0))
+    keys = _bit_reversal_table(n_qubits)[keys]
+    values = np.array(list(counts_0.values())) if len(counts_0) > 0 else np.zeros(0, dtype=np.int64)
+    dense_counts = np.zeros(1 << n_qubits, dtype=values.dtype)
+    dense_counts[keys] = values
+    return dense_counts
+
+
+# Each core already runs its own worker process, so additional OpenMP and BLAS threads only compete for the cores
+_SINGLE_THREAD_ENV = {'OMP_NUM_THREADS': '1', 'OPENBLAS_NUM_THREADS': '1', 'MKL_NUM_THREADS': '1'}
+
+
+def _init_worker():
+    """ Limits the OpenMP and BLAS thread pools that are already loaded in the worker to a single thread.
+
+    The environment variables only reach libraries loaded after the worker started. With the fork start method, numpy's
+    BLAS and OpenMP are already loaded in the parent, and only threadpoolctl can limit them. It is optional, without it
+    _create_pool prints a warning and the worker keeps the thread pools it inherited.
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=1)
+
+
+def _create_pool(n_processes: int):
+    """ Creates a pool with n_processes workers, which are limited to a single thread.
+    """
+    if importlib.util.find_spec("threadpoolctl") is None:
+        print("Warning: threadpoolctl is not installed, so the workers keep the OpenMP and BLAS threads which are "
+              "already loaded in this process. Install threadpoolctl to limit them to a single thread.")
+
+    # The workers inherit the environment of the parent when they are started, so we set it only meanwhile
+    previous_env = {key: os.environ.get(key) for key in _SINGLE_THREAD_ENV}
+    os.environ.update(_SINGLE_THREAD_ENV)
+    try:
+        return multiprocessing.Pool(n_processes, initializer=_init_worker)
+    finally:
+        for key, value in previous_env.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+
+
+def _simulation_size(arg) -> int:
+    """ Returns the number of qubits of the simulation argument, or 0 if it does not specify it.
+    """
+    if isinstance(arg, dict):
+        return arg.get("nqubit", 0)
+    return getattr(arg, "nqubit", 0)
 
 
 def perform_parallel_simulation_with_multiprocessing(args: list, simulation: callable, max_workers: int=None):
@@ -57,13 +128,16 @@ def perform_parallel_simulation_with_multiprocessing(args: list, simulation: cal
     n_processes = max(int(0.8 * cpu_count), 2)
     print(f"Use 80% of the cores, so {n_processes} processes.")
 
+    # The cost grows exponentially with the number of qubits, so we start the largest simulations first and hand out
+    # the tasks one by one, such that idle workers pick up the remaining ones
     simulations = len(args)
-    chunksize = max(1, int(simulations / n_processes) + (1 if simulations % n_processes > 0 else 0))
+    chunksize = 1
     print(f"As we perform {simulations} simulations, we use a chunksize of {chunksize}.")
+    tasks = sorted(args, key=_simulation_size, reverse=True)
 
     # Compute
-    p = multiprocessing.Pool(n_processes)
-    for time, nqubit in p.imap_unordered(func=simulation, iterable=args, chunksize=chunksize):
+    p = _create_pool(n_processes)
+    for time, nqubit in p.imap_unordered(func=simulation, iterable=tasks, chunksize=chunksize):
         print(f"Simulated {nqubit} qubits in {time} s.", flush=True)
 
     # Shut down pool
@@ -76,6 +150,9 @@ def perform_parallel_simulation(args: list, simulation: callable, max_workers: i
 
     Preserves the order of the given comprehension list. We create a deepcopy of the argument, the simulation currently
     modifies it during execution.
+
+    Returns:
+        The list of the return values of the simulations, in the order of args.
     """
     if max_workers is None:
         print("We use max_workers = None, so the default value min(32, os.cpu_count() + 4).")
@@ -84,8 +161,8 @@ def perform_parallel_simulation(args: list, simulation: callable, max_workers: i
 
     # Execute parallel simulations
     with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_list = [val for val in executor.map(simulation, args)]
-        concurrent.futures.wait(future_list)
+        results = list(executor.map(simulation, args))
+    return results
 
 
 def mock_perform_parallel_simulation(args: dict, simulation: callable, max_workers: int=None):
@@ -100,20 +177,36 @@ def mock_perform_parallel_simulation(args: dict, simulation: callable, max_worke
         simulation(arg)
 
 
-def compute_Hellinger_distance(p_ng: float, p_real: float, nqubits: int) -> float:
+def compute_Hellinger_distance(p_ng: np.array, p_real: np.array, nqubits: int) -> float:
     """ Given two distributions as array, returns the Hellinger distance.
+
+    Both distributions must have 2**nqubits entries.
+    """
+    if len(p_ng) != 2**nqubits or len(p_real) != 2**nqubits:
+        raise ValueError(
+            f"Expected distributions with {2**nqubits} entries for {nqubits} qubits, but found {len(p_ng)} and "
+          + f"{len(p_real)} entries."
+        )
+    diff = np.sqrt(p_real)
+    diff -= np.sqrt(p_ng)
+    return np.sqrt(0.5 * np.dot(diff, diff))
+
+
+def compute_Hellinger_distance_batch(p_ng: np.array, p_real: np.array) -> np.array:
+    """ Given two batches of distributions as arrays of shape (B, 2**nqubits), returns the B Hellinger distances of the
+    pairs of rows.
     """
-    dh_ng = (np.sqrt(p_real)-np.sqrt(p_ng))**2
-    h_ng = 0
+    diff = np.sqrt(p_real)
+    diff -= np.sqrt(p_ng)
+    return np.sqrt(0.5 * np.einsum('ij,ij->i', diff, diff))
 
-    for i in range(2**nqubits):
-        h_ng = h_ng + dh_ng[i]
 
-    h_ng = (1/np.sqrt(2)) * np.sqrt(h_ng)
-    return h_ng  
+# Version of the transpilation pipeline in create_qc_list_parameterized, increase it when the pipeline changes such
+# that cached circuits of the previous pipeline are not reused
+_TRANSPILE_CACHE_VERSION = 3
 
 
-def create_qc_list(circuit_generator, nqubits_list, qubits_layout, backend):
+def create_qc_list(circuit_generator, nqubits_list, qubits_layout, backend, cache_dir: str=None):
     """ Creates a list of quantum circuit.
 
     Args:
@@ -121,34 +214,154 @@ def create_qc_list(circuit_generator, nqubits_list, qubits_layout, backend):
         nqubits_list (list[int]): List of the qubit numbers for which a quantum circuit should be generated.
         qubits_layout (list[int]): Layout of the qubits in the backend.
         backend: IBM backend.
+        cache_dir (str): Optional folder in which the transpiled circuits are stored in the QPY format and reused in
+            later calls. By default, nothing is cached.
 
     Returns:
         A list of transpiled circuits, generated by the Qiskit transpiler. The list items correspond 1:1 to the items in
         the list of qubits.
     """
-    print("Warning:")
-    print("1) At the moment, we perform the transpilation step in two steps because of a bug in Qiskit. ")
-    print("   See https://qiskit.slack.com/archives/C7SS31917/p1670411292978089 for more infos.")
-    print("2) We assume a linear connectivity.")
-    sim = AerSimulator()
-    result_list = []
-    for nqubit in nqubits_list:
-        coupling_map = CouplingMap.from_line(nqubit, bidirectional=True)
-        qc1 = transpile(
-            circuits=circuit_generator(nqubit),
-            backend=sim,
+    pairs = create_qc_list_parameterized(circuit_generator, nqubits_list, qubits_layout, backend, cache_dir)
+    return [qc for qc, _ in pairs]
+
+
+def create_qc_list_parameterized(param_template, nqubits_list, qubits_layout, backend, cache_dir: str=None):
+    """ Creates a list of parameterized quantum circuits, which are transpiled once and bound afterwards.
+
+    Use this instead of create_qc_list when the circuits only differ in numeric angles. Each evaluation then only binds
+    the values instead of running the transpiler again.
+
+    Example:
+        pairs = create_qc_list_parameterized(param_template, [2, 3], [0, 1, 2], backend)
+        qc, params = pairs[0]
+        bound_qc = qc.assign_parameters(dict(zip(params, values)), inplace=False)
+
+    Args:
+        param_template (callable): Function which takes the number of qubits and returns a Qiskit circuit, which may
+            contain unbound Qiskit parameters.
+        nqubits_list (list[int]): List of the qubit numbers for which a quantum circuit should be generated.
+        qubits_layout (list[int]): Layout of the qubits in the backend.
+        backend: IBM backend.
+        cache_dir (str): Optional folder in which the transpiled circuits are stored in the QPY format and reused in
+            later calls. By default, nothing is cached. Circuits which cannot be exported to OpenQASM 2, e.g. with
+            unbound parameters or control flow, are not cached. Circuits with custom gates, e.g. unitary gates, get a
+            new key in every run and never hit the cache.
+
+    Returns:
+        A list of tuples (transpiled circuit, list of parameters), where the parameters are the unbound Qiskit
+        parameters of the transpiled circuit. The list items correspond 1:1 to the items in the list of qubits.
+    """
+    print("Warning: We assume a linear connectivity.")
+    result_list = [None] * len(nqubits_list)
+    tasks = []
+    for i, nqubit in enumerate(nqubits_list):
+        circuit = param_template(nqubit)
+        layout = qubits_layout[0:nqubit]
+
+        # Reuse the transpiled circuit if the same circuit was already transpiled for this backend and layout. Circuits
+        # which cannot be exported to OpenQASM for the key, e.g. with unbound parameters, are not cached.
+        cache_file = None
+        if cache_dir is not None and not circuit.parameters:
+            try:
+                cache_file = os.path.join(cache_dir, f"{_transpile_cache_key(circuit, backend, layout)}.qpy")
+            except QiskitError:
+                cache_file = None
+            if cache_file is not None and os.path.isfile(cache_file):
+                with open(cache_file, "rb") as f:
+                    result_list[i] = qpy.load(f)[0]
+                continue
+
+        # Single pass manager, routing is restricted to the couplings between the qubits of the layout
+        coupling_map = CouplingMap()
+        for q in range(backend.num_qubits):
+            coupling_map.add_physical_qubit(q)
+        for q_ctr, q_trg in backend.coupling_map.get_edges():
+            if q_ctr in layout and q_trg in layout:
+                coupling_map.add_edge(q_ctr, q_trg)
+
+        # The backend is not passed, otherwise the routing uses its target and not the restricted coupling map
+        pm = generate_preset_pass_manager(
+            optimization_level=1,
+            basis_gates=list(backend.operation_names),
+            instruction_durations=backend.instruction_durations,
+            timing_constraints=backend.target.timing_constraints(),
             coupling_map=coupling_map,
-            seed_transpiler=42
-        )
-        qc2 = transpile(
-            circuits=qc1,
-            backend=backend,
+            initial_layout=layout,
             scheduling_method='asap',
-            initial_layout=qubits_layout[0:nqubit],
             seed_transpiler=42,
         )
-        result_list.append(qc2)
-    return result_list
+        if _is_native_circuit(circuit, layout, coupling_map, backend.operation_names):
+            # Circuit is already in the basis of the backend and respects the connectivity, so we only apply the
+            # layout and then run the same scheduling stage as the full pass manager
+            layout_pm = PassManager([
+                SetLayout(Layout.from_intlist(layout, *circuit.qregs)),
+                FullAncillaAllocation(coupling_map),
+                EnlargeWithAncilla(),
+                ApplyLayout(),
+            ])
+            pm = StagedPassManager(stages=["layout", "scheduling"], layout=layout_pm, scheduling=pm.scheduling)
+        tasks.append((i, cache_file, pm, circuit))
+
+    # Transpile the remaining circuits with the parallel map of Qiskit, which respects its parallel settings and runs
+    # serially where needed. The backend is not always picklable, so the workers receive the pass managers serialized
+    # with dill, as Qiskit does itself.
+    args = [(dill.dumps(pm), circuit) for _, _, pm, circuit in tasks]
+    transpiled_list = parallel_map(_transpile_one, args)
+
+    for (i, cache_file, _, _), qc in zip(tasks, transpiled_list):
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_file, "wb") as f:
+                qpy.dump(qc, f)
+        result_list[i] = qc
+    return [(qc, list(qc.parameters)) for qc in result_list]
+
+
+def _transpile_cache_key(circuit, backend, layout: list) -> str:
+    """ Returns the key of the transpiled circuit in the cache.
+
+    Besides the circuit, backend and layout, the key contains everything else that changes the transpiled circuit: the
+    version of our transpilation pipeline, the Qiskit version and the gate durations of the backend, which change with
+    each calibration and determine the delays of the scheduling.
+    """
+    durations = backend.instruction_durations
+    fingerprint = repr(sorted(durations.duration_by_name_qubits.items())) + repr(durations.dt)
+    content = "\n".join([
+        str(_TRANSPILE_CACHE_VERSION),
+        qiskit.__version__,
+        circuit.qasm(),
+        backend.name,
+        str(layout),
+        fingerprint,
+    ])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _is_native_circuit(circuit, layout: list, coupling_map, basis_gates) -> bool:
+    """ Checks whether the circuit only uses gates of the basis, and whether its two qubit gates act on coupled qubits
+    once the layout is applied.
+    """
+    ops = set(circuit.count_ops()) - {'measure', 'barrier', 'delay'}
+    if not ops.issubset(basis_gates):
+        return False
+
+    edges = set(coupling_map.get_edges())
+    for instruction in circuit.data:
+        if instruction.operation.name == 'barrier':
+            continue
+        qubits = [circuit.find_bit(q).index for q in instruction.qubits]
+        if len(qubits) > 2:
+            return False
+        if len(qubits) == 2 and (layout[qubits[0]], layout[qubits[1]]) not in edges:
+            return False
+    return True
+
+
+def _transpile_one(args: tuple):
+    """ Runs the dill serialized pass manager on the circuit, both given in the tuple args.
+    """
+    pm_bin, circuit = args
+    return dill.loads(pm_bin).run(circuit)
 
 
 def load_config(filename: str="") -> dict:
@@ -163,12 +376,21 @@ def load_config(filename: str="") -> dict:
         input_filename = filename
 
     config_filename = input_filename if len(input_filename) > 0 else filename
-    f = open(f"configuration/{config_filename}")
-    config = json.load(f)
+    path = os.path.abspath(f"configuration/{config_filename}")
+    config = json.loads(_read_config_cached(path, os.path.getmtime(path)))
     print(f"Loaded configuration {config_filename}.")
     return config
 
 
+@ft.lru_cache(maxsize=32)
+def _read_config_cached(path: str, mtime: float) -> bytes:
+    """ Reads the bytes of the json file at the path. The modification time is part of the cache key, so a changed
+    file is read again. The bytes are parsed on each call, such that every caller gets its own config.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+
 def setup_backend(Token: str, hub: str, group: str, project: str, device_name: str):
     """Takes the backend configuration and returns the configured backend.
 
@@ -183,9 +405,20 @@ def setup_backend(Token: str, hub: str, group: str, project: str, device_name: s
         An IBM Quantum provider backend object that provides access to the
         specified quantum device.
     """
-    IBMProvider.delete_account()
-    IBMProvider.save_account(token=Token)
-    provider = IBMProvider(instance=f"{hub}/{group}/{project}")
+    # Only rewrite the stored account if it does not hold this token yet
+    saved_accounts = IBMProvider.saved_accounts(default=True)
+    if not any(account.get("token") == Token for account in saved_accounts.values()):
+        IBMProvider.delete_account()
+        IBMProvider.save_account(token=Token)
+    return _get_backend(Token, f"{hub}/{group}/{project}", device_name)
+
+
+@ft.lru_cache(maxsize=32)
+def _get_backend(Token: str, instance: str, device_name: str):
+    """ Returns the backend of the device in the instance, the token is part of the cache key such that a new account
+    does not reuse the backend of the previous one.
+    """
+    provider = IBMProvider(instance=instance)
     return provider.get_backend(device_name)
 
 
@@ -208,12 +441,31 @@ def post_process_split(source_filenames: list, target_filenames: list, split: in
     assert not all((os.path.isfile(f) for f in target_filenames)), "At least one target files already exists."
     assert split > 1, f"Using a split of {split} does not make sense."
 
-    i = 0
-    for target_file in target_filenames:
-        target_array = np.loadtxt(source_filenames[i])
-        for source_file in source_filenames[i+1:i+split]:
-            target_array += np.loadtxt(source_file)
-        mean_array = target_array / split
-        np.savetxt(target_file, mean_array)
-        i += split
+    # Each target only depends on its own sources, so the reductions run in separate processes
+    sources_list = [source_filenames[i*split:(i+1)*split] for i in range(len(target_filenames))]
+    max_workers = min(len(target_filenames), os.cpu_count() or 1)
+    if max_workers == 1:
+        for target_file, sources in zip(target_filenames, sources_list):
+            _reduce_split(target_file, sources, split)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_reduce_split, target_filenames, sources_list, itertools.repeat(split)))
     return
+
+
+def _reduce_split(target_file: str, source_filenames: list, split: int):
+    """ Averages the arrays stored in the source files and saves the mean in the target file.
+    """
+    # Accumulate the running sum in place and turn it into the mean without further temporaries
+    target_array = _read_split_file(source_filenames[0])
+    for source_file in source_filenames[1:]:
+        target_array += _read_split_file(source_file)
+    np.divide(target_array, split, out=target_array)
+    np.savetxt(target_file, target_array)
+
+
+def _read_split_file(filename: str) -> np.array:
+    """ Loads the array of a source file of post_process_split with a pinned dtype. Files with a single value are
+    loaded as 1d array, such that they can be saved with np.savetxt again.
+    """
+    return np.loadtxt(filename, dtype=np.float64, ndmin=1)
@@ -1 +1,2 @@
 from ._utility.simulations_utility import compute_Hellinger_distance as hellinger_distance
+from ._utility.simulations_utility import compute_Hellinger_distance_batch as hellinger_distance_batch
@@ -0,0 +1,191 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip("qiskit")
+
+from qiskit import QuantumCircuit
+from qiskit.circuit import Parameter
+from qiskit.providers.fake_provider import FakeManilaV2
+
+from quantum_gates.utilities import (
+    create_qc_list,
+    create_qc_list_parameterized,
+    fix_counts,
+    fix_counts_array,
+    hellinger_distance,
+    hellinger_distance_batch,
+    load_config,
+    post_process_split,
+)
+
+
+def _fix_counts_reference(counts_0: dict, n_qubits: int):
+    """ Original list based implementation of fix_counts. """
+    mirrored_counts = {j[::-1]: counts_0[j] for j in counts_0}
+    counts = sorted(mirrored_counts.items())
+    if int(counts[0][0], 2) != 0:
+        counts.insert(0, (format(0, 'b').zfill(n_qubits), 0))
+    if int(counts[len(counts)-1][0], 2) != 2**n_qubits - 1:
+        counts.insert(len(counts), (format(2**n_qubits - 1, 'b').zfill(n_qubits), 0))
+    for j in range(2**n_qubits-1):
+        if int(counts[j+1][0], 2) != int(counts[j][0], 2) + 1:
+            counts.insert(j+1, (format(int(counts[j][0], 2) + 1, 'b').zfill(n_qubits), 0))
+    return counts
+
+
+@pytest.mark.parametrize("n_qubits", list(range(1, 9)))
+def test_fix_counts_matches_reference(n_qubits: int):
+    rng = random.Random(n_qubits)
+    for _ in range(50):
+        states = rng.sample(range(2**n_qubits), rng.randint(1, 2**n_qubits))
+        counts_0 = {format(k, 'b').zfill(n_qubits): rng.randint(1, 100) for k in states}
+        assert fix_counts(counts_0, n_qubits) == _fix_counts_reference(counts_0, n_qubits)
+
+
+def test_fix_counts_keeps_float_values():
+    counts = fix_counts({'01': 0.25, '10': 0.75}, 2)
+    assert counts == [('00', 0.0), ('01', 0.75), ('10', 0.25), ('11', 0.0)]
+    assert fix_counts_array({'01': 0.25, '10': 0.75}, 2).dtype == np.float64
+
+
+def test_fix_counts_empty_dict():
+    assert fix_counts({}, 2) == [('00', 0), ('01', 0), ('10', 0), ('11', 0)]
+
+
+def test_fix_counts_array():
+    counts = fix_counts_array({'01': 3, '11': 2}, 2)
+    assert counts.dtype == np.int64
+    assert counts.tolist() == [0, 0, 3, 2]
+
+
+def test_hellinger_distance_known_value():
+    assert hellinger_distance(np.array([0.5, 0.5]), np.array([1.0, 0.0]), 1) == pytest.approx(0.5412, abs=1e-4)
+    assert hellinger_distance(np.array([0.5, 0.5]), np.array([0.5, 0.5]), 1) == pytest.approx(0.0)
+
+
+def test_hellinger_distance_rejects_wrong_length():
+    with pytest.raises(ValueError):
+        hellinger_distance(np.ones(3) / 3, np.ones(3) / 3, 2)
+
+
+def test_hellinger_distance_batch_matches_single():
+    rng = np.random.default_rng(42)
+    p_ng = rng.random((5, 8))
+    p_real = rng.random((5, 8))
+    p_ng /= p_ng.sum(axis=1, keepdims=True)
+    p_real /= p_real.sum(axis=1, keepdims=True)
+    expected = [hellinger_distance(p_ng[i], p_real[i], 3) for i in range(5)]
+    assert np.allclose(hellinger_distance_batch(p_ng, p_real), expected)
+
+
+def test_post_process_split(tmp_path):
+    sources = [str(tmp_path / f"source{i}.txt") for i in range(4)]
+    targets = [str(tmp_path / f"target{i}.txt") for i in range(2)]
+    for i, source in enumerate(sources):
+        np.savetxt(source, np.arange(6.0).reshape(2, 3) * i)
+
+    post_process_split(sources, targets, 2)
+
+    assert np.allclose(np.loadtxt(targets[0]), np.arange(6.0).reshape(2, 3) * 0.5)
+    assert np.allclose(np.loadtxt(targets[1]), np.arange(6.0).reshape(2, 3) * 2.5)
+
+
+def test_post_process_split_single_value(tmp_path):
+    sources = [str(tmp_path / f"source{i}.txt") for i in range(2)]
+    target = str(tmp_path / "target.txt")
+    for i, source in enumerate(sources):
+        np.savetxt(source, np.array([float(i + 1)]))
+
+    post_process_split(sources, [target], 2)
+
+    assert np.allclose(np.loadtxt(target), 1.5)
+
+
+def test_create_qc_list_parameterized_binds_parameters(tmp_path):
+    theta = Parameter("theta")
+
+    def param_template(n_qubits: int):
+        circ = QuantumCircuit(n_qubits, n_qubits)
+        circ.rx(theta, 0)
+        circ.cx(0, 1)
+        circ.measure(range(n_qubits), range(n_qubits))
+        return circ
+
+    pairs = create_qc_list_parameterized(param_template, [2], [0, 1, 2], FakeManilaV2(), cache_dir=str(tmp_path))
+    qc, params = pairs[0]
+
+    assert [p.name for p in params] == ["theta"]
+    bound_qc = qc.assign_parameters(dict(zip(params, [0.3])), inplace=False)
+    assert len(bound_qc.parameters) == 0
+    assert len(qc.parameters) == 1
+    assert not any(tmp_path.iterdir()), "Circuits with unbound parameters should not be cached."
+
+
+def test_create_qc_list_routes_within_layout():
+    backend = FakeManilaV2()
+    qubits_layout = [0, 1, 2]
+    edges = set(backend.coupling_map.get_edges())
+
+    def circuit_generator(n_qubits: int):
+        circ = QuantumCircuit(n_qubits, n_qubits)
+        circ.h(0)
+        circ.cx(0, n_qubits - 1)
+        circ.cx(n_qubits - 1, 1)
+        circ.measure(range(n_qubits), range(n_qubits))
+        return circ
+
+    qc = create_qc_list(circuit_generator, [3], qubits_layout, backend, cache_dir=None)[0]
+
+    for instruction in qc.data:
+        if instruction.operation.num_qubits == 2:
+            q_ctr, q_trg = (qc.find_bit(q).index for q in instruction.qubits)
+            assert q_ctr in qubits_layout and q_trg in qubits_layout
+            assert (q_ctr, q_trg) in edges
+
+
+def test_create_qc_list_reuses_cached_circuit(tmp_path):
+    backend = FakeManilaV2()
+
+    def circuit_generator(n_qubits: int):
+        circ = QuantumCircuit(n_qubits, n_qubits)
+        circ.h(0)
+        circ.cx(0, 1)
+        circ.measure(range(n_qubits), range(n_qubits))
+        return circ
+
+    qc_first = create_qc_list(circuit_generator, [2], [0, 1], backend, cache_dir=str(tmp_path))[0]
+    assert len(list(tmp_path.iterdir())) == 1
+    qc_second = create_qc_list(circuit_generator, [2], [0, 1], backend, cache_dir=str(tmp_path))[0]
+    assert len(list(tmp_path.iterdir())) == 1
+    assert qc_second.count_ops() == qc_first.count_ops()
+
+
+def test_create_qc_list_keeps_order():
+    def circuit_generator(n_qubits: int):
+        circ = QuantumCircuit(n_qubits, n_qubits)
+        circ.h(0)
+        for q in range(n_qubits - 1):
+            circ.cx(q, q + 1)
+        circ.measure(range(n_qubits), range(n_qubits))
+        return circ
+
+    qc_list = create_qc_list(circuit_generator, [3, 2, 4], [0, 1, 2, 3], FakeManilaV2())
+    assert [qc.num_clbits for qc in qc_list] == [3, 2, 4]
+
+
+def test_load_config_returns_fresh_and_updated_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "configuration").mkdir()
+    config_file = tmp_path / "configuration" / "config.json"
+    config_file.write_text('{"angles": [1, 2]}')
+
+    config = load_config("config.json")
+    config["angles"].append(3)
+    assert load_config("config.json") == {"angles": [1, 2]}
+
+    config_file.write_text('{"angles": [5]}')
+    os.utime(config_file, (os.path.getatime(config_file), os.path.getmtime(config_file) + 10))
+    assert load_config("config.json") == {"angles": [5]}
@@ -4,9 +4,12 @@ from ._utility.simulations_utility import (
     mock_perform_parallel_simulation as mock_parallel_simulation,
     perform_parallel_simulation as concurrent_parallel_simulation,
     fix_counts,
+    fix_counts_array,
     load_config,
     create_qc_list,
+    create_qc_list_parameterized,
     setup_backend,
     post_process_split,
     compute_Hellinger_distance as hellinger_distance,
+    compute_Hellinger_distance_batch as hellinger_distance_batch,
 )